@@ -1,18 +1,50 @@
 import os
-import sqlparse
-from typing import Dict
+import functools
 
+from google.api_core.client_info import ClientInfo
 from google.cloud import bigquery_datatransfer
 from google.cloud import bigquery
 from google.cloud.exceptions import NotFound
 
+from entity_meta import EntityMeta
 
-def create_merge_query(metadata: Dict, raw_table_id: str, rf_table_id: str) -> str:
-    entity = metadata['name']
-    fields = metadata['fields']
-    keys = metadata['keys']
+
+CLIENT_INFO = ClientInfo(user_agent='ssff-gcp-ingestion-framework')
+
+# repr() yields a valid BigQuery string literal and escapes the quotes
+# that SAP labels routinely contain
+FIELD_DDL = "{name} {type} {mode} OPTIONS(description={description!r})"
+
+
+@functools.lru_cache(maxsize=4)
+def _bq_client(project: str) -> bigquery.Client:
+    return bigquery.Client(project=project, client_info=CLIENT_INFO)
+
+
+@functools.lru_cache(maxsize=4)
+def _transfer_client(project: str) -> bigquery_datatransfer.DataTransferServiceClient:
+    return bigquery_datatransfer.DataTransferServiceClient(
+        client_options={
+            'quota_project_id': project
+        }
+    )
+
+
+# How far back an already-merged row may still receive updates. Target
+# partitions older than this window are pruned away from the MERGE join.
+MERGE_PRUNE_LOOKBACK_DAYS = int(os.getenv('MERGE_PRUNE_LOOKBACK_DAYS', '30'))
+
+# Below this delta/refined row ratio the auto strategy switches from MERGE
+# to DELETE+INSERT, which avoids the outer join and rewrites fewer files.
+DELETE_INSERT_MAX_DELTA_RATIO = 0.01
+
+
+def create_merge_query(metadata: EntityMeta, raw_table_id: str, rf_table_id: str) -> str:
+    entity = metadata.name
+    keys = metadata.keys
 
     base_query = """
+    {prune_declarations}
     MERGE INTO
     {rf_table_id} AS target
     USING(
@@ -35,28 +67,128 @@ def create_merge_query(metadata: Dict, raw_table_id: str, rf_table_id: str) -> s
     );
     """
 
-    column_names = [field['name'] for field in fields]
-
-    columns = ', '.join(column_names)
-    condition = ' AND '.join([f'source.{key}=target.{key}' for key in keys])
-    mapping = ', '.join([f'target.{column}=source.{column}' for column in column_names])
-
-    merge_query = sqlparse.format(
-        base_query.format(
-            entity=entity,
-            raw_table_id=raw_table_id,
-            rf_table_id=rf_table_id,
-            columns=columns,
-            condition=condition,
-            column_mapping=mapping
-        ),
-        reindent=True,
-        keyword_case='upper'
+    # Computing the bounds into script variables gives the planner literal
+    # values, so target partitions outside the window are pruned before the
+    # MERGE join instead of scanning the whole refined table.
+    prune_declarations_template = """
+    DECLARE min_date, max_date DATE;
+    SET (min_date, max_date) = (
+    SELECT AS STRUCT
+    DATE_SUB(MIN(DATE({ts_field})), INTERVAL {lookback} DAY),
+    MAX(DATE({ts_field}))
+    FROM {raw_table_id}
+    WHERE TIMESTAMP_TRUNC(_PARTITIONTIME, DAY) = TIMESTAMP(FORMAT_DATE("%Y-%m-%d",CURRENT_DATE()))
+    );
+    """
+
+    columns = ', '.join(metadata.field_names)
+    condition = ' AND '.join(f'source.{key}=target.{key}' for key in keys)
+    mapping = ', '.join(f'target.{column}=source.{column}' for column in metadata.field_names)
+
+    ts_field = metadata.timestamp_field
+    prune_declarations = ''
+
+    if ts_field is not None:
+        prune_declarations = prune_declarations_template.format(
+            ts_field=ts_field,
+            lookback=MERGE_PRUNE_LOOKBACK_DAYS,
+            raw_table_id=raw_table_id
+        )
+        condition = f'{condition} AND DATE(target.{ts_field}) BETWEEN min_date AND max_date'
+    else:
+        # The refined table falls back to ingestion-time partitioning and
+        # requires a partition filter, so bound the target side explicitly
+        condition = (
+            f'{condition} AND target._PARTITIONDATE >= '
+            f'DATE_SUB(CURRENT_DATE(), INTERVAL {MERGE_PRUNE_LOOKBACK_DAYS} DAY)'
+        )
+
+    merge_query = base_query.format(
+        entity=entity,
+        raw_table_id=raw_table_id,
+        rf_table_id=rf_table_id,
+        columns=columns,
+        condition=condition,
+        column_mapping=mapping,
+        prune_declarations=prune_declarations
     )
 
     return merge_query
 
 
+def create_delete_insert_query(metadata: EntityMeta, raw_table_id: str, rf_table_id: str) -> str:
+    entity = metadata.name
+    keys = metadata.keys
+
+    # For small daily deltas the DELETE prunes files via clustering and the
+    # INSERT is an append-only write, so no outer join or full rewrite of
+    # the refined table happens.
+    base_query = """
+    BEGIN TRANSACTION;
+
+    CREATE TEMP TABLE _source AS
+    SELECT
+    {columns}
+    FROM {raw_table_id}
+    WHERE TIMESTAMP_TRUNC(_PARTITIONTIME, DAY) = TIMESTAMP(FORMAT_DATE("%Y-%m-%d",CURRENT_DATE()));
+
+    DELETE FROM {rf_table_id}
+    WHERE {partition_filter}
+    AND STRUCT({key_columns}) IN (SELECT STRUCT({key_columns}) FROM _source);
+
+    INSERT INTO {rf_table_id}(
+    {columns}
+    )
+    SELECT
+    {columns}
+    FROM _source;
+
+    COMMIT TRANSACTION;
+    """
+
+    ts_field = metadata.timestamp_field
+    partition_column = f'DATE({ts_field})' if ts_field is not None else '_PARTITIONDATE'
+    partition_filter = (
+        f'{partition_column} >= '
+        f'DATE_SUB(CURRENT_DATE(), INTERVAL {MERGE_PRUNE_LOOKBACK_DAYS} DAY)'
+    )
+
+    delete_insert_query = base_query.format(
+        entity=entity,
+        raw_table_id=raw_table_id,
+        rf_table_id=rf_table_id,
+        columns=', '.join(metadata.field_names),
+        key_columns=', '.join(keys),
+        partition_filter=partition_filter
+    )
+
+    return delete_insert_query
+
+
+def choose_merge_strategy(raw_table_id: str, rf_table_id: str) -> str:
+    strategy = os.getenv('MERGE_STRATEGY', 'auto').lower()
+
+    if strategy in ('merge', 'delete_insert'):
+        return strategy
+
+    project = os.getenv('RF_PROJECT_ID')
+    client = _bq_client(project)
+
+    delta_count_query = f"""
+    SELECT COUNT(*)
+    FROM {raw_table_id}
+    WHERE TIMESTAMP_TRUNC(_PARTITIONTIME, DAY) = TIMESTAMP(FORMAT_DATE("%Y-%m-%d",CURRENT_DATE()))
+    """
+
+    delta_rows = next(iter(client.query_and_wait(delta_count_query)))[0]
+    refined_rows = client.get_table(rf_table_id).num_rows
+
+    if refined_rows and delta_rows / refined_rows < DELETE_INSERT_MAX_DELTA_RATIO:
+        return 'delete_insert'
+
+    return 'merge'
+
+
 def create_bq_module_dataset(client, dataset_id: str):
     dataset = bigquery.Dataset(dataset_id)
     dataset.location = "US"
@@ -65,19 +197,16 @@ def create_bq_module_dataset(client, dataset_id: str):
     print(f'Created dataset {client.project}.{dataset.dataset_id}')
 
 
-def create_bq_refined_table(metadata: Dict) -> str:
+def create_bq_refined_table(metadata: EntityMeta) -> str:
     project = os.getenv('RF_PROJECT_ID')
 
-    entity = metadata['name']
-    module = metadata['module']
-    fields = metadata['fields']
-    keys = metadata['keys']
-    entity_description = metadata.get('description', '')
+    entity = metadata.name
+    fields = metadata.fields
+    keys = metadata.keys
+    entity_description = metadata.description
 
-    dataset_module = module[module.find("(")+1: module.find(")")].lower().strip()
-
-    client = bigquery.Client(project=project)
-    dataset_id = f'{project}.ds_sfsf_{dataset_module}'
+    client = _bq_client(project)
+    dataset_id = f'{project}.ds_sfsf_{metadata.dataset_module}'
 
     try:
         client.get_dataset(dataset_id)
@@ -88,13 +217,24 @@ def create_bq_refined_table(metadata: Dict) -> str:
 
     table_id = f'{dataset_id}.{entity}'
 
+    ts_field = metadata.timestamp_field
+    if ts_field is not None:
+        partition_by = f'PARTITION BY DATE({ts_field})'
+    else:
+        partition_by = 'PARTITION BY _PARTITIONDATE'
+
+    # BigQuery clusters on at most 4 columns; require_partition_filter
+    # keeps every consumer (including the generated MERGE) on the pruned
+    # path.
     ddl = f"""
         CREATE TABLE IF NOT EXISTS {table_id}(
-            {','.join([field['name'] + " " + field['type'] + " " + field['mode'] + " " + "OPTIONS(description='" + field['description'] + "')" for field in fields])}
+            {','.join(FIELD_DDL.format(**field) for field in fields)}
         )
-        CLUSTER BY {','.join(keys)}
+        {partition_by}
+        CLUSTER BY {','.join(keys[:4])}
         OPTIONS (
-            description='{entity_description}'
+            description={entity_description!r},
+            require_partition_filter=TRUE
         );
     """
 
@@ -106,7 +246,7 @@ def create_bq_refined_table(metadata: Dict) -> str:
 
 def run_merge_query_once(query: str):
     project = os.getenv('RF_PROJECT_ID')
-    client = bigquery.Client(project=project)
+    client = _bq_client(project)
 
     result = client.query_and_wait(query, wait_timeout=600)
 
@@ -117,11 +257,7 @@ def create_scheduled_query(query: str, entity: str):
     project = os.getenv('RF_PROJECT_ID')
     sq_service_account = os.getenv('BQ_SQ_SA')
 
-    transfer_client = bigquery_datatransfer.DataTransferServiceClient(
-        client_options={
-            'quota_project_id': project
-        }
-    )
+    transfer_client = _transfer_client(project)
 
     service_account_name = sq_service_account
 
@@ -0,0 +1,54 @@
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class EntityMeta:
+    """Immutable view of a processed SuccessFactors entity.
+
+    Built once from the parsed $metadata document so the table creators
+    and query builders share the precomputed dataset module and field
+    names instead of re-deriving them, and none of them can mutate the
+    schema another one is about to read.
+    """
+
+    name: str
+    keys: Tuple[str, ...]
+    fields: Tuple[Dict, ...]
+    module: str
+    description: str
+    dataset_module: str
+    field_names: Tuple[str, ...]
+    timestamp_field: Optional[str]
+
+    @classmethod
+    def from_parsed(cls, metadata: Dict) -> 'EntityMeta':
+        module = metadata['module']
+        field_names = tuple(field['name'] for field in metadata['fields'])
+
+        if 'lastModifiedDateTime' in field_names:
+            timestamp_field = 'lastModifiedDateTime'
+        elif 'lastModifiedOn' in field_names:
+            timestamp_field = 'lastModifiedOn'
+        else:
+            timestamp_field = None
+
+        return cls(
+            name=metadata['name'],
+            keys=tuple(metadata['keys']),
+            fields=tuple(metadata['fields']),
+            module=module,
+            description=metadata.get('description', ''),
+            dataset_module=module[module.find("(")+1: module.find(")")].lower().strip(),
+            field_names=field_names,
+            timestamp_field=timestamp_field
+        )
+
+    def as_dict(self) -> Dict:
+        return {
+            'name': self.name,
+            'keys': list(self.keys),
+            'fields': [dict(field) for field in self.fields],
+            'module': self.module,
+            'description': self.description
+        }
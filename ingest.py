@@ -1,16 +1,23 @@
 import os
-import json
+import re
+import gzip
+import math
+import base64
+import orjson
 import argparse
+import functools
 import requests
 import xmltodict
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from typing import Dict, List
 
+from google.api_core.client_info import ClientInfo
 from google.cloud import bigquery
 from google.cloud.exceptions import NotFound
 from google.cloud import storage
-from google.cloud.storage import transfer_manager
 
+from entity_meta import EntityMeta
 from ssff_utils import build_ssff_json_pipeline
 import bigquery_sq_utils as bq_utils
 
@@ -18,6 +25,33 @@ import bigquery_sq_utils as bq_utils
 SSFF_USER = os.getenv('SSFF_USER')
 SSFF_PASSWORD = os.getenv('SSFF_PASSWORD')
 
+PAGE_SIZE = 1000
+MAX_WORKERS = 8
+
+SESSION = requests.Session()
+SESSION.auth = requests.auth.HTTPBasicAuth(SSFF_USER, SSFF_PASSWORD)
+SESSION.mount(
+    'https://',
+    requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=16)
+)
+
+CLIENT_INFO = ClientInfo(user_agent='ssff-gcp-ingestion-framework')
+
+
+@functools.lru_cache(maxsize=4)
+def _bq_client(project: str) -> bigquery.Client:
+    return bigquery.Client(project=project, client_info=CLIENT_INFO)
+
+
+@functools.lru_cache(maxsize=4)
+def _gcs_client(project: str) -> storage.Client:
+    return storage.Client(project=project, client_info=CLIENT_INFO)
+
+
+@functools.lru_cache(maxsize=4)
+def _temp_bucket(bucket_name: str) -> storage.Bucket:
+    return _gcs_client(os.getenv('PROJECT_ID')).bucket(bucket_name)
+
 
 data_type_mapping = {
     # Per documentation: https://help.sap.com/docs/SAP_BUSINESSOBJECTS_BUSINESS_INTELLIGENCE_PLATFORM/aa4cb9ab429349e49678e146f05d7341/ec3302ce6fdb101497906a7cb0e91070.html
@@ -40,26 +74,62 @@ data_type_mapping = {
     'Edm.String': 'STRING'
 }
 
-data_type_conversion_mapping = {
-    'STRING': '{field_name}',
-    'DATETIME': 'EXTRACT(DATETIME FROM TIMESTAMP_MILLIS(CAST(REGEXP_EXTRACT({field_name}, r"/Date\((-?\d+)\)") AS INT64))) AS {field_name}',
-    'TIMESTAMP': 'TIMESTAMP_MILLIS(CAST(REGEXP_EXTRACT({field_name}, r"/Date\(([-+]?\d+)\+0000\)/") AS INT64)) AS {field_name}',
-    'FLOAT': 'CAST({field_name} AS FLOAT64) AS {field_name}',
-    'BYTES': 'SELECT CAST(cast(REGEXP_EXTRACT({field_name}, r"[X|binary]\'([A-Fa-f0-9][A-Fa-f0-9]*)\'") AS BYTES) AS STRING)'
+# OData v2 serializes temporal and binary values as /Date(millis)/ and
+# X'hex' strings; converting them while the rows are already in hand lets
+# the load job write the typed final table directly, with no raw STRING
+# table and no second CAST pass in BigQuery. The patterns are compiled
+# once here instead of per value in the hot row loop.
+ODATA_DATE_PATTERN = re.compile(r'/Date\(([-+]?\d+)')
+ODATA_BINARY_PATTERN = re.compile(r"[X|binary]'([A-Fa-f0-9]+)'")
+
+
+def _odata_to_datetime(value: str):
+    match = ODATA_DATE_PATTERN.search(value)
+    if match is None:
+        return None
+
+    millis = int(match.group(1))
+
+    return datetime.fromtimestamp(millis / 1000, tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def _odata_to_timestamp(value: str):
+    converted = _odata_to_datetime(value)
+
+    return converted + '+00:00' if converted is not None else None
+
+
+def _odata_to_bytes(value: str):
+    match = ODATA_BINARY_PATTERN.search(value)
+    if match is None:
+        return None
+
+    return base64.b64encode(bytes.fromhex(match.group(1))).decode()
+
+
+json_value_converters = {
+    'DATETIME': _odata_to_datetime,
+    'TIMESTAMP': _odata_to_timestamp,
+    'BYTES': _odata_to_bytes
 }
 
+# BigQuery load schemas accept the standard SQL type names except DECIMAL
+bq_load_type_mapping = {
+    'DECIMAL': 'NUMERIC'
+}
+
+# repr() yields a valid BigQuery string literal and escapes the quotes
+# that SAP labels routinely contain
+FIELD_DDL = "{name} {type} {mode} OPTIONS(description={description!r})"
+
 
 def get_entity_count(entity: str) -> Dict:
-    response = requests.get(
-        url=f"https://api19.sapsf.com/odata/v2/{entity}/$count",
-        auth=requests.auth.HTTPBasicAuth(
-            SSFF_USER,
-            SSFF_PASSWORD
-        )
+    response = SESSION.get(
+        url=f"https://api19.sapsf.com/odata/v2/{entity}/$count"
     )
 
     try:
-        count = int(response.text)
+        count = int(response.content)
     except Exception as e:
         print(e)
         print(response.text)
@@ -67,99 +137,99 @@ def get_entity_count(entity: str) -> Dict:
     return count
 
 
-def get_entity_metadata(entity: str) -> Dict:
-    response = requests.get(
+def get_entity_metadata(entity: str):
+    response = SESSION.get(
         url=f"https://api19.sapsf.com/odata/v2/{entity}/$metadata",
-        auth=requests.auth.HTTPBasicAuth(
-            SSFF_USER,
-            SSFF_PASSWORD
-        )
+        stream=True
     )
+    response.raw.decode_content = True
 
-    try:
-        data_dict = xmltodict.parse(response.text)
-    except Exception as e:
-        print(e)
-        print(response.text)
-
-    return data_dict
+    return response.raw
 
 
 def get_columns_description(field: Dict) -> str:
-    if field.get('@sap:picklist', False):
-        description = field['@sap:label'] + '. PickList: ' + field['@sap:picklist'] + '.'
+    if field.get('sap:picklist', False):
+        description = field['sap:label'] + '. PickList: ' + field['sap:picklist'] + '.'
     else:
-        description = field['@sap:label'] + '.'
+        description = field['sap:label'] + '.'
 
     return description
 
 
-def process_metadata(metadata: Dict) -> Dict:
-    doc_schema = metadata['edmx:Edmx']['edmx:DataServices']['Schema'][0]
-    fields_schema = metadata['edmx:Edmx']['edmx:DataServices']['Schema'][1]
-    documentation = doc_schema['EntityContainer']['EntitySet']['Documentation']
-
-    # Entity name
-    name = fields_schema['EntityType']['@Name']
-
-    # Entity description
-    entity_description = documentation['LongDescription']
-
-    # Entity keys
-    if isinstance(fields_schema['EntityType']['Key']['PropertyRef'], Dict):
-        keys = [fields_schema['EntityType']['Key']['PropertyRef']['@Name']]
-    else:
-        keys = [key['@Name']for key in fields_schema['EntityType']['Key']['PropertyRef']]
-
-    # Entity fields
-    fields = [
-        {
-            'name': field['@Name'],
-            'type': data_type_mapping.get(field['@Type']),
-            'mode': '' if field['@Nullable'] == "true" else "NOT NULL",
-            'description': get_columns_description(field)
-        } for field in metadata['edmx:Edmx']['edmx:DataServices']['Schema'][1]['EntityType']['Property'] if field['@sap:visible'] == 'true'
-    ]
-
-    # Entity module
-    tags = documentation['sap:tagcollection']['sap:tag']
-    if isinstance(tags, List):
-        module = tags[0]
-    elif isinstance(tags, str):
-        module = tags
-    else:
-        raise Exception('Could not extract SSFF module name from the metadata')
-
+def process_metadata(metadata_stream) -> Dict:
+    # Elements at depth 5 of the $metadata document are streamed one at a
+    # time instead of materializing the whole document as a dict:
+    # edmx:Edmx/edmx:DataServices/Schema/EntityContainer/EntitySet carries
+    # the Documentation block, and edmx:Edmx/edmx:DataServices/Schema/
+    # EntityType holds Key and one Property element per column.
     entity_dict = {
-        'name': name,
-        'keys': keys,
-        'fields': fields,
-        'module': module,
-        'description': entity_description
+        'name': None,
+        'keys': [],
+        'fields': [],
+        'module': None,
+        'description': None
     }
 
-    return entity_dict
-
-
-def get_next_page_url(page: Dict):
-    if '__next' not in page.keys():
-        return None
+    def on_element(path, item):
+        tag, attrs = path[-1]
+        attrs = attrs or {}
+
+        if tag == 'Property':
+            entity_type = path[-2][1] or {}
+            if entity_dict['name'] is None:
+                entity_dict['name'] = entity_type.get('Name')
+            if entity_dict['name'] == entity_type.get('Name') and attrs.get('sap:visible') == 'true':
+                entity_dict['fields'].append({
+                    'name': attrs['Name'],
+                    'type': data_type_mapping.get(attrs['Type']),
+                    'edm_type': attrs['Type'],
+                    'mode': '' if attrs['Nullable'] == "true" else "NOT NULL",
+                    'nullable': attrs['Nullable'] == "true",
+                    'description': get_columns_description(attrs)
+                })
+        elif tag == 'Key' and not entity_dict['keys']:
+            property_refs = item['PropertyRef']
+            if isinstance(property_refs, Dict):
+                entity_dict['keys'] = [property_refs['@Name']]
+            else:
+                entity_dict['keys'] = [key['@Name']for key in property_refs]
+        elif tag == 'EntitySet' and entity_dict['description'] is None:
+            documentation = (item or {}).get('Documentation')
+            if documentation is not None:
+                entity_dict['description'] = documentation['LongDescription']
+                tags = documentation['sap:tagcollection']['sap:tag']
+                if isinstance(tags, List):
+                    entity_dict['module'] = tags[0]
+                elif isinstance(tags, str):
+                    entity_dict['module'] = tags
+
+        return True
+
+    xmltodict.parse(
+        metadata_stream,
+        item_depth=5,
+        item_callback=on_element,
+        xml_attribs=True
+    )
 
-    next = page.get('__next')
+    if entity_dict['module'] is None:
+        raise Exception('Could not extract SSFF module name from the metadata')
 
-    return next
+    return entity_dict
 
 
 def make_odata_request(url: str) -> Dict:
-    response = requests.get(
+    # Best effort: endpoints that honor this omit per-row __metadata,
+    # saving ~100B of payload per row; store_data still strips the field
+    # for the v2 endpoints that keep sending it
+    response = SESSION.get(
         url=url,
-        auth=requests.auth.HTTPBasicAuth(
-            SSFF_USER,
-            SSFF_PASSWORD
-        )
+        headers={'Accept': 'application/json;odata.metadata=none'}
     )
 
-    json_response = response.json()
+    # orjson parses the raw bytes directly, skipping the str decode and
+    # slow stdlib parse that response.json() would do
+    json_response = orjson.loads(response.content)
     data = json_response.get('d', None)
 
     if data is not None:
@@ -168,28 +238,48 @@ def make_odata_request(url: str) -> Dict:
         raise Exception(response.text)
 
 
-def get_entity_data(metadata: Dict) -> List:
-    page_number = 0
-    fields = metadata['fields']
-    metadata_fields = [field['name'] for field in fields]
+def iter_entity_pages(entity: str, field_names: List, page_count: int):
+    base_url = f"https://api19.sapsf.com/odata/v2/{entity}?$select={','.join(field_names)}&paging=snapshot&$format=json"
+
+    def fetch_page(page: int) -> List:
+        sf_odata_url = f'{base_url}&$top={PAGE_SIZE}&$skip={page * PAGE_SIZE}'
+        response = make_odata_request(url=sf_odata_url)
+
+        return response.get('results', [])
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        yield from executor.map(fetch_page, range(page_count))
 
-    entity = metadata['name']
 
-    entity_row_count = get_entity_count(entity=entity)
+def get_entity_data(metadata: EntityMeta, prefix: str, entity_row_count: int) -> int:
+    entity = metadata.name
+
+    converters = {
+        field['name']: json_value_converters[field['type']]
+        for field in metadata.fields if field['type'] in json_value_converters
+    }
+
     print(f'Processing {entity_row_count} rows from entity: {entity}')
-    sf_odata_url = f"https://api19.sapsf.com/odata/v2/{entity}?$select={','.join(metadata_fields)}&paging=snapshot&$format=json"
 
-    next_page = 'null'
+    # Always emit at least one page so an empty entity still produces a
+    # loadable (empty) file and the rest of the onboarding proceeds
+    page_count = max(math.ceil(entity_row_count / PAGE_SIZE), 1)
 
-    while next_page is not None:
-        response = make_odata_request(url=sf_odata_url)
-        results = response.get('results')
+    # Fetchers and writers run in separate pools, so the next page
+    # downloads while the previous one is transformed and uploaded
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as writers:
+        store_futures = []
+
+        for page, results in enumerate(iter_entity_pages(entity, metadata.field_names, page_count)):
+            print(f'Iterating page: {page}. Rows: {len(results)}')
+            store_futures.append(
+                writers.submit(store_data, entity, results, page, prefix, converters)
+            )
+
+        for future in store_futures:
+            future.result()
 
-        print(f'Iterating page: {page_number}. Rows: {len(results)}')
-        store_data(entity=entity, data=results, page=page_number)
-        next_page = get_next_page_url(response)
-        sf_odata_url = next_page
-        page_number += 1
+    return page_count
 
 
 def create_bq_module_dataset(client, dataset_id: str):
@@ -200,19 +290,16 @@ def create_bq_module_dataset(client, dataset_id: str):
     print(f'Created dataset {client.project}.{dataset.dataset_id}')
 
 
-def create_bq_final_table(metadata: Dict) -> str:
+def create_bq_final_table(metadata: EntityMeta) -> str:
     project = os.getenv('PROJECT_ID')
 
-    entity = metadata['name']
-    module = metadata['module']
-    fields = metadata['fields']
-    keys = metadata['keys']
-    entity_description = metadata.get('description', '')
+    entity = metadata.name
+    fields = metadata.fields
+    keys = metadata.keys
+    entity_description = metadata.description
 
-    dataset_module = module[module.find("(")+1: module.find(")")].lower().strip()
-
-    client = bigquery.Client(project=project)
-    dataset_id = f'{project}.ds_sfsf_{dataset_module}'
+    client = _bq_client(project)
+    dataset_id = f'{project}.ds_sfsf_{metadata.dataset_module}'
 
     try:
         client.get_dataset(dataset_id)
@@ -225,42 +312,12 @@ def create_bq_final_table(metadata: Dict) -> str:
 
     ddl = f"""
         CREATE TABLE IF NOT EXISTS {table_id}(
-            {','.join([field['name'] + " " + field['type'] + " " + field['mode'] + " " + "OPTIONS(description='" + field['description'] + "')" for field in fields])}
+            {','.join(FIELD_DDL.format(**field) for field in fields)}
         )
         PARTITION BY DATE_TRUNC(_PARTITIONTIME, DAY)
         CLUSTER BY {','.join(keys)}
         OPTIONS (
-            description='{entity_description}'
-        );
-    """
-
-    table = client.query_and_wait(ddl)
-    print(f'Created table {table_id}')
-
-    return table_id
-
-
-def create_bq_raw_table(metadata: Dict) -> str:
-    project = os.getenv('PROJECT_ID')
-
-    entity = metadata['name']
-    module = metadata['module']
-    fields = metadata['fields']
-
-    for field in fields:
-        if field['type'] != 'BOOL':
-            field.update({'type': 'STRING'})
-
-    dataset_module = module[module.find("(")+1: module.find(")")].lower().strip()
-
-    client = bigquery.Client(project=project)
-    dataset_id = f'{project}.ds_sfsf_{dataset_module}'
-
-    table_id = f'{dataset_id}.temp_{entity}'
-
-    ddl = f"""
-        CREATE TABLE IF NOT EXISTS {table_id}(
-            {','.join([field['name'] + " " + field['type'] for field in fields])}
+            description={entity_description!r}
         );
     """
 
@@ -270,71 +327,70 @@ def create_bq_raw_table(metadata: Dict) -> str:
     return table_id
 
 
-def store_data(entity: str, data: List, page: int):
-    out_file = open(
-        f"./data/{entity}_data_{page}.json",
-        "w"
-    )
+def store_data(entity: str, data: List, page: int, prefix: str, converters: Dict):
+    # Bind the hot-loop lookup to a local; at ~1000 rows/page the
+    # per-row attribute lookups add up
+    converter_items = tuple(converters.items())
 
     for line in data:
-        line.pop('__metadata')
-        out_file.write(json.dumps(line, indent=None)+'\n')
-    
-    out_file.close()
+        line.pop('__metadata', None)
+        for name, convert in converter_items:
+            value = line.get(name)
+            if value is not None:
+                line[name] = convert(value)
 
+    # Single write of the whole page keeps the upload-chunk count at one
+    # per page instead of one per row.
+    payload = b'\n'.join(orjson.dumps(line) for line in data)
 
-def store_metadata(entity: str, metadata: List):
-    out_file = open(
-        f"./metadata/{entity}_metadata.json",
-        "w"
-    )
+    blob = _temp_bucket(os.getenv('TEMP_BUCKET')).blob(f'{prefix}/{entity}_data_{page}.json.gz')
 
-    json.dump(metadata, out_file, indent=2)
-    out_file.close()
+    # OData JSON repeats every field name per row and compresses 8-15x;
+    # level 1 keeps the compressor off the critical path
+    with blob.open('wb', chunk_size=8 << 20, if_generation_match=0) as out_file:
+        with gzip.GzipFile(fileobj=out_file, mode='wb', compresslevel=1) as gz_file:
+            if payload:
+                gz_file.write(payload + b'\n')
 
 
-def move_data_local_to_gcs(prefix: str):
-    path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data')
-    filenames = [filename for filename in os.listdir(path) if filename.endswith('.json')]
-    bucket_name = os.getenv('TEMP_BUCKET')
-    workers = 8
+def store_metadata(entity: str, metadata: Dict):
+    with open(f"./metadata/{entity}_metadata.json", "wb") as out_file:
+        out_file.write(orjson.dumps(metadata, option=orjson.OPT_INDENT_2))
 
-    project = os.getenv('PROJECT_ID')
-    storage_client = storage.Client(project=project)
-    bucket = storage_client.bucket(bucket_name)
-
-    results = transfer_manager.upload_many_from_filenames(
-        bucket, filenames,
-        source_directory=path,
-        blob_name_prefix=prefix+'/',
-        max_workers=workers
-    )
-
-    for name, result in zip(filenames, results):
-        if isinstance(result, Exception):
-            print("Failed to upload {} due to exception: {}".format(name, result))
-        else:
-            print("Uploaded {} to {}.".format(name, bucket.name))
 
-
-def insert_data_into_bq(metadata: Dict, prefix: str, table_id: str):
+def insert_data_into_bq(metadata: EntityMeta, prefix: str, table_id: str, pages: int):
     bucket_name = os.getenv('TEMP_BUCKET')
     project = os.getenv('PROJECT_ID')
 
-    fields = metadata['fields']
+    entity = metadata.name
+    fields = metadata.fields
 
-    client = bigquery.Client(project=project)
+    client = _bq_client(project)
 
     job_config = bigquery.LoadJobConfig(
         schema=[
-            bigquery.SchemaField(field['name'], "STRING" if field['type']!='BOOL' else field['type']) for field in fields
+            bigquery.SchemaField(
+                field['name'],
+                bq_load_type_mapping.get(field['type'], field['type']),
+                mode='NULLABLE' if field['nullable'] else 'REQUIRED'
+            ) for field in fields
         ],
         source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+        autodetect=False,
+        ignore_unknown_values=True,
+        create_disposition=bigquery.CreateDisposition.CREATE_NEVER,
+        write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
     )
-    uri = f'gs://{bucket_name}/{prefix}/*.json'
+
+    # Naming the page files explicitly skips the GCS listing a wildcard
+    # URI would trigger and lets the load read the shards in parallel
+    source_uris = [
+        f'gs://{bucket_name}/{prefix}/{entity}_data_{page}.json.gz'
+        for page in range(pages)
+    ]
 
     load_job = client.load_table_from_uri(
-        uri,
+        source_uris,
         table_id,
         location='US',
         job_config=job_config,
@@ -346,84 +402,40 @@ def insert_data_into_bq(metadata: Dict, prefix: str, table_id: str):
     print(f'Loaded {destination_table.num_rows} rows into {destination_table.table_id}.')
 
 
-def insert_raw_into_final_bq(formatted_table: str, raw_table: str):
-    project = os.getenv('PROJECT_ID')
-
-    client = bigquery.Client(project=project)
-
-    base_query = """
-    INSERT INTO {target_table}(
-    {target_columns}
-    )
-    SELECT
-    {select_statement}
-    FROM {source_table};
-    """
-
-    select_lines = []
-    formatted_table = client.get_table(table=formatted_table)
-    raw_table = client.get_table(table=raw_table)
-
-    formatted_schema = formatted_table.schema
-    raw_schema = raw_table.schema
-
-    field_mapping = {
-        field.name: field.field_type for field in formatted_schema
-    }
+def _chunked(iterable, size: int):
+    batch = []
 
-    default_conversion_expr = 'CAST({field_name} AS {default_type}) AS {field_name}'
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
 
-    for field in raw_schema:
-        type = field_mapping.get(field.name)
+    if batch:
+        yield batch
 
-        select_line = ""
-        try:
-            select_line = data_type_conversion_mapping[type]
-            select_line = select_line.format(field_name=field.name)
-        except KeyError:
-            print(f'Type {type} not in the initial mapping. Defaulting to straight cast: CAST(x as A_TYPE).')
-            select_line = default_conversion_expr.format(
-                field_name=field.name,
-                default_type=type
-            )
 
-        select_line = '\t'+select_line
-
-        select_lines.append(select_line)
-
-    final_insert_query = base_query.format(
-        table_name=raw_table,
-        select_statement=',\n'.join(select_lines),
-        source_table=raw_table,
-        target_table=formatted_table,
-        target_columns=',\n'.join([field.name for field in raw_schema])
-    )
-
-    results = client.query_and_wait(final_insert_query)
-    print(f'Insert Job with ID: {results._job_id} affected {results._num_dml_affected_rows}')
-
-
-def gcp_clean_up(temp_table_id: str, prefix: str):
+def gcp_clean_up(prefix: str):
     project = os.getenv('PROJECT_ID')
     bucket_name = os.getenv('TEMP_BUCKET')
 
     print('Cleaning up in GCP ...')
-    # Delete BQ temp table
-    client = bigquery.Client(project=project)
-    client.delete_table(temp_table_id, not_found_ok=True)
-    print(f'Deleted table {temp_table_id}')
+    # Delete prefix in GCS: iterate the listing lazily and fan batches of
+    # deletes out to threads, keeping memory at O(batch) for large ingests
+    bucket = _gcs_client(project).bucket(bucket_name)
 
-    # Delete prefix in GCS
-    storage_client = storage.Client(project=project)
+    def delete_batch(blobs: List):
+        bucket.delete_blobs(blobs=blobs, on_error=lambda blob: None)
 
-    bucket = storage_client.bucket(bucket_name)
     try:
-        bucket.delete_blobs(blobs=list(bucket.list_blobs(prefix=prefix)))
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            for batch in _chunked(bucket.list_blobs(prefix=prefix, page_size=1000), 100):
+                executor.submit(delete_batch, batch)
         print(f'Prefix {prefix} deleted')
     except NotFound:
-        print('Prefix {prefix} not found. Skipping')
+        print(f'Prefix {prefix} not found. Skipping')
     except Exception as e:
-        print(str(e.message))
+        print(repr(e))
 
 
 if __name__ == '__main__':
@@ -433,45 +445,68 @@ if __name__ == '__main__':
     args = parser.parse_args()
     entity = args.entity
 
-    metadata = get_entity_metadata(entity=entity)
-    parsed_metadata = process_metadata(metadata=metadata)
-    store_metadata(entity=entity, metadata=parsed_metadata)
+    # $metadata and $count are independent round trips to the SSFF
+    # endpoint, so overlap them before any data flows
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        metadata_future = executor.submit(get_entity_metadata, entity)
+        count_future = executor.submit(get_entity_count, entity)
+
+        parsed_metadata = EntityMeta.from_parsed(
+            process_metadata(metadata_stream=metadata_future.result())
+        )
+        entity_row_count = count_future.result()
+
+    store_metadata(entity=entity, metadata=parsed_metadata.as_dict())
 
     timestamp = datetime.now().strftime("%Y-%m-%d_%H%M%S")
     prefix = entity.lower() + '_' + timestamp
 
-    # Historical load and raw infra provision
-    final_table_id = create_bq_final_table(metadata=parsed_metadata)
-    rf_table_id = bq_utils.create_bq_refined_table(
-        metadata=parsed_metadata
-    )
-    temp_table_id = create_bq_raw_table(metadata=parsed_metadata)
+    # Historical load and infra provision. The two DDLs are independent
+    # BigQuery round trips, so fire them concurrently
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        final_table_future = executor.submit(create_bq_final_table, parsed_metadata)
+        rf_table_future = executor.submit(bq_utils.create_bq_refined_table, parsed_metadata)
+
+        final_table_id = final_table_future.result()
+        rf_table_id = rf_table_future.result()
+
     dataset_id = final_table_id.split('.')[1]
 
-    get_entity_data(metadata=parsed_metadata)
-    move_data_local_to_gcs(prefix=prefix)
-    insert_data_into_bq(
+    page_count = get_entity_data(
         metadata=parsed_metadata,
         prefix=prefix,
-        table_id=temp_table_id
+        entity_row_count=entity_row_count
     )
-
-    insert_raw_into_final_bq(
-        formatted_table=final_table_id,
-        raw_table=temp_table_id
+    insert_data_into_bq(
+        metadata=parsed_metadata,
+        prefix=prefix,
+        table_id=final_table_id,
+        pages=page_count
     )
 
-    gcp_clean_up(temp_table_id=temp_table_id, prefix=prefix)
+    gcp_clean_up(prefix=prefix)
 
     # Builds SSFF JSON pipeline
-    build_ssff_json_pipeline(metadata=metadata, dataset=dataset_id)
+    build_ssff_json_pipeline(metadata=parsed_metadata, dataset=dataset_id)
 
     # Creates BQ scheduled query
-    merge_query = bq_utils.create_merge_query(
-        metadata=parsed_metadata,
+    strategy = bq_utils.choose_merge_strategy(
         raw_table_id=final_table_id,
         rf_table_id=rf_table_id
     )
 
+    if strategy == 'delete_insert':
+        merge_query = bq_utils.create_delete_insert_query(
+            metadata=parsed_metadata,
+            raw_table_id=final_table_id,
+            rf_table_id=rf_table_id
+        )
+    else:
+        merge_query = bq_utils.create_merge_query(
+            metadata=parsed_metadata,
+            raw_table_id=final_table_id,
+            rf_table_id=rf_table_id
+        )
+
     bq_utils.run_merge_query_once(query=merge_query)
     bq_utils.create_scheduled_query(query=merge_query, entity=entity)
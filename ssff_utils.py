@@ -1,9 +1,17 @@
 import os
-import json
+import orjson
+import functools
 from typing import Dict, List
 
 from google.cloud import storage
 
+from entity_meta import EntityMeta
+
+
+@functools.lru_cache(maxsize=1)
+def _gcs_client() -> storage.Client:
+    return storage.Client()
+
 
 data_type_mapping = {
     "Edm.SByte": 'int',
@@ -29,23 +37,25 @@ def set_default(obj) -> List:
     raise TypeError
 
 
-def get_filter(fields: Dict) -> str:
+@functools.lru_cache(maxsize=None)
+def _timestamp_field(field_names: frozenset) -> str:
+    return 'lastModifiedDateTime' if 'lastModifiedDateTime' in field_names else 'lastModifiedOn'
+
+
+def get_filter(fields: List) -> str:
     base_filter = "lastModifiedDateTime ge datetime'${logicalStartTime(yyyy-MM-dd,1d)}T00:00:00' and lastModifiedDateTime le datetime'${logicalStartTime(yyyy-MM-dd'T'HH:mm:ss)}'"
-    if 'lastModifiedDateTime' in [field['name'] for field in fields]:
+    datetime_field = _timestamp_field(frozenset(field['name'] for field in fields))
+
+    if datetime_field == 'lastModifiedDateTime':
         return base_filter
-    else:
-        base_filter = base_filter.replace('lastModifiedDateTime', 'lastModifiedOn')
-    return base_filter
-    
 
-def get_upsert_keys(keys: List) -> str:
-    entity_keys = keys
-    datetime_key = 'lastModifiedDateTime' if 'lastModifiedDateTime' in entity_keys else 'lastModifiedOn'
-    entity_keys.append(datetime_key)
+    return base_filter.replace('lastModifiedDateTime', datetime_field)
 
-    str_upsert_keys = ','.join(entity_keys)
 
-    return str_upsert_keys
+def get_upsert_keys(keys: List, fields: List) -> str:
+    datetime_field = _timestamp_field(frozenset(field['name'] for field in fields))
+
+    return ','.join((*keys, datetime_field))
 
 
 def get_select_fields(fields: Dict) -> str:
@@ -54,37 +64,26 @@ def get_select_fields(fields: Dict) -> str:
     return select_fields
 
 
-def format_metadata(metadata: Dict) -> Dict:
-    fields_schema = metadata['edmx:Edmx']['edmx:DataServices']['Schema'][1]
-
-    # Entity name
-    name = fields_schema['EntityType']['@Name']
-
-    # Entity keys
-    if isinstance(fields_schema['EntityType']['Key']['PropertyRef'], Dict):
-        keys = [fields_schema['EntityType']['Key']['PropertyRef']['@Name']]
-    else:
-        keys = [key['@Name']for key in fields_schema['EntityType']['Key']['PropertyRef']]
-
-    # Entity fields
+def format_metadata(metadata: EntityMeta) -> Dict:
+    # Entity fields keeping the raw Edm type for the Avro schema mapping
     fields = [
         {
-            'name': field['@Name'],
-            'type': field['@Type'],
-            'nullable': field['@Nullable'] == "true",
-        } for field in fields_schema['EntityType']['Property'] if field['@sap:visible'] == 'true'
+            'name': field['name'],
+            'type': field['edm_type'],
+            'nullable': field['nullable'],
+        } for field in metadata.fields
     ]
 
     formatted_metadata = {
-        'name': name,
-        'keys': keys,
+        'name': metadata.name,
+        'keys': list(metadata.keys),
         'fields': fields
     }
 
     return formatted_metadata
 
 
-def build_ssff_json_pipeline(metadata: Dict, dataset: str):
+def build_ssff_json_pipeline(metadata: EntityMeta, dataset: str):
     formatted_metadata = format_metadata(metadata=metadata)
     metadata_fields = formatted_metadata['fields']
     entity = formatted_metadata['name']
@@ -116,10 +115,10 @@ def build_ssff_json_pipeline(metadata: Dict, dataset: str):
         "fields": json_fields
     }
 
-    base_schema_json = json.dumps(base_schema, default=set_default)
+    base_schema_json = orjson.dumps(base_schema, default=set_default).decode()
 
-    pipeline_json_file = open('base_pipeline_ssff.json')
-    pipeline = json.load(pipeline_json_file)
+    with open('base_pipeline_ssff.json', 'rb') as pipeline_json_file:
+        pipeline = orjson.loads(pipeline_json_file.read())
 
     output_schema = {
         "name": "etlSchemaBody",
@@ -145,7 +144,7 @@ def build_ssff_json_pipeline(metadata: Dict, dataset: str):
     # Target
     pipeline['config']['stages'][1]['plugin']['properties']['table'] = entity
     
-    pipeline['config']['stages'][1]['plugin']['properties']['relationTableKey'] = get_upsert_keys(keys=keys)
+    pipeline['config']['stages'][1]['plugin']['properties']['relationTableKey'] = get_upsert_keys(keys=keys, fields=metadata_fields)
     pipeline['config']['stages'][1]['plugin']['properties']['connection'] = '${conn(BigQuery-Raw)}'
     pipeline['config']['stages'][1]['plugin']['properties']['schema'] = base_schema_json
     pipeline['config']['stages'][1]['plugin']['properties']['bucket'] = temp_bucket
@@ -158,14 +157,8 @@ def build_ssff_json_pipeline(metadata: Dict, dataset: str):
 
 
 def store_ssff_json_pipeline(entity: str, pipeline: Dict):
-
-    out_file = open(
-        f"./out/{entity}_SuccessFactors-cdap-data-pipeline.json",
-        "w"
-    )
-
-    json.dump(pipeline, out_file, indent=2)
-    out_file.close()
+    with open(f"./out/{entity}_SuccessFactors-cdap-data-pipeline.json", "wb") as out_file:
+        out_file.write(orjson.dumps(pipeline, option=orjson.OPT_INDENT_2, default=set_default))
 
 
 def upload_ssff_json_pipeline(entity: str):
@@ -173,8 +166,7 @@ def upload_ssff_json_pipeline(entity: str):
     source_file_name = f"./out/{entity}_SuccessFactors-cdap-data-pipeline.json"
     destination_blob_name = F"{entity}_SuccessFactors-cdap-data-pipeline.json"
 
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
+    bucket = _gcs_client().bucket(bucket_name)
     blob = bucket.blob(destination_blob_name)
 
     blob.upload_from_filename(filename=source_file_name)